@@ -1,6 +1,7 @@
 from pathlib import Path
 import polars as pl
 import shutil
+from urllib.parse import unquote
 import time
 
 parquet_path = Path("/Volumes/T7/openalex-parquet")
@@ -33,11 +34,14 @@ def format_time(seconds):
 
 
 for i, topic_dir in enumerate(topic_dirs, 1):
-    topic_id = topic_dir.name.split("=")[1]
+    topic_id = unquote(topic_dir.name.split("=", 1)[1])
     topic_start_time = time.time()
     print(f"Processing topic_id={topic_id} ({i}/{len(topic_dirs)})...")
 
-    merged_topic_df = pl.read_parquet(topic_dir / "**/*.parquet")
+    # The part files carry topic_id only in their (URL-encoded) directory name
+    merged_topic_df = pl.read_parquet(topic_dir / "**/*.parquet").with_columns(
+        pl.lit(topic_id).alias("topic_id")
+    )
     df_len = len(merged_topic_df)
     total_items += df_len
 
@@ -1,6 +1,7 @@
 from pathlib import Path
 import polars as pl
 import shutil
+from urllib.parse import unquote
 
 parquet_path = Path("/Volumes/T7/openalex-parquet")
 authors_path = parquet_path / "pre-dernom" / "authors"
@@ -16,10 +17,13 @@ print(f"Found {len(topic_dirs)} topic partitions")
 total_items = 0
 
 for topic_dir in topic_dirs:
-    topic_id = topic_dir.name.split("=")[1]
+    topic_id = unquote(topic_dir.name.split("=", 1)[1])
     print(f"Processing topic_id={topic_id}...")
 
-    merged_topic_df = pl.read_parquet(topic_dir / "**/*.parquet")
+    # The part files carry topic_id only in their (URL-encoded) directory name
+    merged_topic_df = pl.read_parquet(topic_dir / "**/*.parquet").with_columns(
+        pl.lit(topic_id).alias("topic_id")
+    )
     df_len = len(merged_topic_df)
     total_items += df_len
 
@@ -4,32 +4,91 @@ Prepare Topics for Search
 
 This script adds full-text search and semantic search capabilities to the topics table:
 1. Creates full-text indexes on display_name and description
-2. Adds an embedding column
+2. Adds embedding columns
 3. Generates embeddings for semantic search
+4. Creates an HNSW index on the embeddings
 
 Usage:
     python prepare_topics_search.py [--db-path path/to/database.duckdb]
 """
 
 import argparse
+import asyncio
+import functools
+import queue
 import sys
 import os
+import tempfile
+import threading
 from pathlib import Path
 import duckdb
 import time
 from google import genai
 from google.genai import types
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from typing import List
 
+EMBEDDING_DIM = 768
+
+# Embedding storage: full-precision vectors for HNSW and exact scoring
+EMBEDDING_COLUMNS = {
+    "embedding": f"FLOAT[{EMBEDDING_DIM}]",
+    # Materialized TOPIC_TEXT_SQL, the text that gets embedded
+    "search_text": "VARCHAR",
+    # hash() of the text the embedding was generated from, to detect edits
+    "text_hash": "UBIGINT",
+}
+
+# int8 copy stored by earlier versions and dropped on the next run: the VSS
+# HNSW index and DuckDB's array distance functions only accept FLOAT/DOUBLE
+# arrays, so no query could score on it without casting every row back
+LEGACY_EMBEDDING_COLUMNS = ["embedding_i8", "embedding_scale"]
+
+# Gemini embedding model and request config shared by topics and queries
+GEMINI_EMBEDDING_MODEL = "gemini-embedding-001"
+GEMINI_EMBED_CONFIG = types.EmbedContentConfig(
+    task_type="SEMANTIC_SIMILARITY", output_dimensionality=EMBEDDING_DIM
+)
+
+# Maximum number of texts the Gemini API accepts in one embed_content request
+GEMINI_MAX_BATCH_SIZE = 100
+
+# Maximum number of embed_content requests in flight at once
+GEMINI_MAX_CONCURRENT_REQUESTS = 16
+
+# HNSW graph parameters: neighbours per node and candidate list size while building
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 128
+
+# Hybrid search rescores the union of this many BM25 and nearest-neighbour hits
+HYBRID_CANDIDATES = 100
+
+# Embedding progress is printed every this many batches or seconds
+PROGRESS_EVERY_BATCHES = 10
+PROGRESS_INTERVAL = 10.0
+
+# Text embedded for each topic, assembled by DuckDB so rows reach Python as a
+# single string. Empty or missing parts are dropped, like the old Python formatter.
+# It is stored in the search_text column and only recomputed by refresh_search_text.
+TOPIC_TEXT_SQL = """trim(
+    'TOPIC: ' || COALESCE(display_name, '')
+    || COALESCE('. TOPIC DESCRIPTION: ' || NULLIF(description, ''), '')
+    || COALESCE('. subfield: ' || NULLIF(subfield.display_name, ''), '')
+    || COALESCE(', field: ' || NULLIF(field.display_name, ''), '')
+    || COALESCE(', domain: ' || NULLIF(domain.display_name, ''), '')
+)"""
+
 
 def get_script_dir() -> Path:
     """Get the directory where this script is located"""
     return Path(__file__).parent.absolute()
 
 
+@functools.cache
 def initialize_gemini_client() -> genai.Client:
-    """Initialize Gemini client with API key from environment"""
+    """Initialize Gemini client with API key from environment (shared per process)"""
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise ValueError(
@@ -41,26 +100,57 @@ def initialize_gemini_client() -> genai.Client:
     return client
 
 
-def generate_gemini_embeddings(
-    client: genai.Client, texts: List[str]
-) -> List[List[float]]:
-    """Generate normalized embeddings using Gemini API"""
-    result = client.models.embed_content(
-        model="gemini-embedding-001",
-        contents=texts,
-        config=types.EmbedContentConfig(
-            task_type="SEMANTIC_SIMILARITY", output_dimensionality=768
-        ),
+async def generate_gemini_embeddings(
+    client: genai.Client, texts: List[str], semaphore: asyncio.Semaphore
+) -> np.ndarray:
+    """Generate normalized float32 embeddings, one row per text, using Gemini API"""
+
+    # The semaphore is shared by every batch in flight, so it caps requests
+    # across batches rather than within one
+    async def embed_chunk(chunk: List[str]) -> list:
+        async with semaphore:
+            result = await client.aio.models.embed_content(
+                model=GEMINI_EMBEDDING_MODEL, contents=chunk, config=GEMINI_EMBED_CONFIG
+            )
+        return result.embeddings
+
+    # A database batch may be larger than one API request allows, so it is
+    # split into requests that run concurrently (gather keeps their order)
+    results = await asyncio.gather(
+        *(
+            embed_chunk(texts[start : start + GEMINI_MAX_BATCH_SIZE])
+            for start in range(0, len(texts), GEMINI_MAX_BATCH_SIZE)
+        )
+    )
+    return normalize_embeddings([embedding for chunk in results for embedding in chunk])
+
+
+def normalize_embeddings(embedding_objs: list) -> np.ndarray:
+    """Stack Gemini embeddings into unit-length float32 rows"""
+    # One (B, dim) operation, in float32 to match the FLOAT[] columns
+    embeddings = np.array(
+        [embedding_obj.values for embedding_obj in embedding_objs], dtype=np.float32
     )
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    return embeddings
 
-    # Normalize embeddings to unit vectors
-    normalized_embeddings = []
-    for embedding_obj in result.embeddings:
-        embedding_values_np = np.array(embedding_obj.values)
-        normed_embedding = embedding_values_np / np.linalg.norm(embedding_values_np)
-        normalized_embeddings.append(normed_embedding.tolist())
 
-    return normalized_embeddings
+# Query text -> normalized embedding, so repeated queries skip the API call
+_query_embedding_cache: dict[str, List[float]] = {}
+
+
+def embed_query(client: genai.Client, query: str) -> List[float]:
+    """Embed a search query, reusing the cached embedding for repeated queries"""
+    if query not in _query_embedding_cache:
+        # A single query uses the sync client; the aio client stays bound to
+        # the embedding pipeline's event loop
+        result = client.models.embed_content(
+            model=GEMINI_EMBEDDING_MODEL, contents=[query], config=GEMINI_EMBED_CONFIG
+        )
+        embeddings = normalize_embeddings(result.embeddings)
+        _query_embedding_cache[query] = embeddings[0].tolist()
+    return _query_embedding_cache[query]
 
 
 def initialize_extensions(conn: duckdb.DuckDBPyConnection) -> None:
@@ -103,17 +193,20 @@ def check_topics_table(conn: duckdb.DuckDBPyConnection) -> dict:
         count_result = conn.execute("SELECT COUNT(*) FROM topics").fetchone()
         row_count = count_result[0] if count_result else 0
 
-        # Check if embedding column exists
-        columns_result = conn.execute("""
-            SELECT column_name 
+        # Check if all embedding columns exist
+        columns_result = conn.execute(
+            """
+            SELECT COUNT(*) 
             FROM information_schema.columns 
-            WHERE table_name = 'topics' AND column_name = 'embedding'
-        """).fetchone()
+            WHERE table_name = 'topics' AND column_name IN ?
+        """,
+            [list(EMBEDDING_COLUMNS)],
+        ).fetchone()
 
-        has_embedding = columns_result is not None
+        has_embedding = columns_result[0] == len(EMBEDDING_COLUMNS)
 
         print(f"  📋 Topics table found with {row_count:,} rows")
-        print(f"  🔍 Embedding column exists: {has_embedding}")
+        print(f"  🔍 Embedding columns exist: {has_embedding}")
 
         return {"exists": True, "row_count": row_count, "has_embedding": has_embedding}
 
@@ -125,27 +218,28 @@ def check_topics_table(conn: duckdb.DuckDBPyConnection) -> dict:
 def add_embedding_column(
     conn: duckdb.DuckDBPyConnection, force_rebuild: bool = False
 ) -> None:
-    """Add embedding column to topics table if it doesn't exist"""
-    print("🏗️  Adding embedding column...")
+    """Add embedding columns to topics table if they don't exist"""
+    print("🏗️  Adding embedding columns...")
+
+    for column_name, column_type in EMBEDDING_COLUMNS.items():
+        # Drop existing column if forcing rebuild
+        if force_rebuild:
+            try:
+                conn.execute(f"ALTER TABLE topics DROP COLUMN {column_name}")
+                print(f"  🗑️  Dropped existing {column_name} column")
+            except Exception as e:
+                if "does not exist" not in str(e).lower():
+                    print(f"  ⚠️  Warning dropping {column_name} column: {e}")
 
-    # Drop existing embedding column if forcing rebuild
-    if force_rebuild:
         try:
-            conn.execute("ALTER TABLE topics DROP COLUMN embedding")
-            print("  🗑️  Dropped existing embedding column")
+            conn.execute(f"ALTER TABLE topics ADD COLUMN {column_name} {column_type}")
+            print(f"  ✅ {column_name} column added")
         except Exception as e:
-            if "does not exist" not in str(e).lower():
-                print(f"  ⚠️  Warning dropping embedding column: {e}")
-
-    try:
-        conn.execute("ALTER TABLE topics ADD COLUMN embedding FLOAT[768]")
-        print("  ✅ Embedding column added")
-    except Exception as e:
-        if "already exists" in str(e).lower():
-            print("  ⏭️  Embedding column already exists")
-        else:
-            print(f"  ❌ Error adding embedding column: {e}")
-            raise
+            if "already exists" in str(e).lower():
+                print(f"  ⏭️  {column_name} column already exists")
+            else:
+                print(f"  ❌ Error adding {column_name} column: {e}")
+                raise
 
 
 def create_fts_index(
@@ -155,19 +249,20 @@ def create_fts_index(
     print("📇 Creating full-text search index...")
 
     try:
-        # Check if index already exists
+        # Check if index already exists by looking for the match_bm25 macro
+        # the FTS extension creates alongside it
         if not force_rebuild:
-            try:
-                # Try to use the index - if it works, it exists
-                conn.execute("""
-                    SELECT fts_main_topics.match_bm25(id, 'test') 
-                    FROM topics LIMIT 1
-                """)
+            index_exists = conn.execute("""
+                SELECT EXISTS (
+                    SELECT 1 FROM duckdb_functions() 
+                    WHERE schema_name = 'fts_main_topics' 
+                        AND function_name = 'match_bm25'
+                )
+            """).fetchone()[0]
+
+            if index_exists:
                 print("  ⏭️  FTS index already exists (use --force to rebuild)")
                 return
-            except:
-                # Index doesn't exist, continue to create it
-                pass
 
         # Drop existing index if forcing rebuild
         if force_rebuild:
@@ -199,174 +294,321 @@ def create_fts_index(
         duration = time.time() - start_time
         print(f"  ✅ FTS index created in {duration:.2f}s")
 
-        # Test the index
-        test_result = conn.execute("""
-            SELECT COUNT(*) FROM (
-                SELECT fts_main_topics.match_bm25(id, 'machine learning') as score
-                FROM topics 
-                WHERE score > 0
-                LIMIT 5
+        # Smoke test the index; EXISTS stops at the first match instead of
+        # scoring every topic
+        has_match = conn.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM topics 
+                WHERE fts_main_topics.match_bm25(id, 'machine learning') > 0
             )
-        """).fetchone()
+        """).fetchone()[0]
 
-        print(f"  🧪 FTS index test: {test_result[0]} results for 'machine learning'")
+        print(
+            f"  🧪 FTS index test: {'found' if has_match else 'no'} matches for 'machine learning'"
+        )
 
     except Exception as e:
         print(f"  ❌ Error creating FTS index: {e}")
         raise
 
 
-def format_topic_text(topic_data: dict) -> str:
-    """Format topic data into text for embedding generation"""
-    topic = topic_data.get("display_name", "")
-    description = topic_data.get("description", "")
+def build_embeddings_table(
+    topic_ids: List[str], text_hashes: List[int], embeddings: np.ndarray
+) -> pa.Table:
+    """Build an Arrow table of topic ids with their embeddings"""
+    return pa.table(
+        {
+            "id": pa.array(topic_ids, type=pa.string()),
+            "embedding": pa.FixedSizeListArray.from_arrays(
+                embeddings.ravel(), EMBEDDING_DIM
+            ),
+            "text_hash": pa.array(text_hashes, type=pa.uint64()),
+        }
+    )
 
-    # Handle subfield, field, domain which are nested structures
-    subfield = ""
-    field = ""
-    domain = ""
 
-    if topic_data.get("subfield"):
-        subfield = (
-            topic_data["subfield"].get("display_name", "")
-            if isinstance(topic_data["subfield"], dict)
-            else ""
-        )
+def update_topic_embeddings(
+    conn: duckdb.DuckDBPyConnection, batch_table: pa.Table
+) -> None:
+    """Write a batch of embeddings with a single UPDATE joined against an Arrow table"""
+    conn.register("batch_embeddings", batch_table)
+    try:
+        conn.execute("""
+            UPDATE topics
+            SET 
+                embedding = b.embedding,
+                text_hash = b.text_hash
+            FROM batch_embeddings b
+            WHERE topics.id = b.id
+        """)
+    finally:
+        conn.unregister("batch_embeddings")
 
-    if topic_data.get("field"):
-        field = (
-            topic_data["field"].get("display_name", "")
-            if isinstance(topic_data["field"], dict)
-            else ""
-        )
 
-    if topic_data.get("domain"):
-        domain = (
-            topic_data["domain"].get("display_name", "")
-            if isinstance(topic_data["domain"], dict)
-            else ""
-        )
+def write_checkpoint(
+    checkpoint_dir: Path, part_number: int, batch_table: pa.Table
+) -> Path:
+    """Persist a batch of embeddings as a Parquet part before it is applied"""
+    part_path = checkpoint_dir / f"part-{part_number:06d}.parquet"
+    tmp_path = part_path.with_suffix(".parquet.tmp")
+
+    # Write then rename so an interrupted run never leaves a truncated part
+    pq.write_table(batch_table, tmp_path)
+    os.replace(tmp_path, part_path)
+
+    return part_path
+
+
+def refresh_search_text(conn: duckdb.DuckDBPyConnection) -> int:
+    """Materialize the topic text into search_text where it is missing or stale"""
+    return conn.execute(f"""
+        UPDATE topics
+        SET search_text = {TOPIC_TEXT_SQL}
+        WHERE search_text IS DISTINCT FROM {TOPIC_TEXT_SQL}
+    """).fetchone()[0]
 
-    # Format the text
-    text = f"TOPIC: {topic}"
-    if description:
-        text += f". TOPIC DESCRIPTION: {description}"
-    if subfield:
-        text += f". subfield: {subfield}"
-    if field:
-        text += f", field: {field}"
-    if domain:
-        text += f", domain: {domain}"
 
-    return text.strip()
+def restore_checkpoints(
+    conn: duckdb.DuckDBPyConnection, checkpoint_dir: Path, pending_filter: str
+) -> int:
+    """Apply embeddings saved by an earlier run to topics that still need them"""
+    # Newest part wins when a topic was embedded more than once, and only
+    # embeddings of the topic's current text are reused
+    return conn.execute(f"""
+        UPDATE topics
+        SET 
+            embedding = c.embedding,
+            text_hash = c.text_hash
+        FROM (
+            SELECT * EXCLUDE (filename)
+            FROM read_parquet(
+                '{checkpoint_dir / "part-*.parquet"}',
+                filename = true,
+                union_by_name = true
+            )
+            QUALIFY row_number() OVER (PARTITION BY id ORDER BY filename DESC) = 1
+        ) c
+        WHERE topics.id = c.id 
+            AND c.text_hash = hash(topics.search_text)
+            AND ({pending_filter})
+    """).fetchone()[0]
 
 
 def generate_embeddings(
     conn: duckdb.DuckDBPyConnection,
-    batch_size: int = 100,
+    client: genai.Client,
+    batch_size: int = 1000,
     force_regenerate: bool = False,
+    checkpoint_dir: Path | None = None,
 ) -> None:
     """Generate embeddings for all topics"""
     print("🧠 Generating topic embeddings...")
 
-    # Initialize Gemini client
-    print("  📥 Initializing Gemini client...")
-    client = initialize_gemini_client()
-    print("  ✅ Gemini client initialized")
-
-    # Check how many topics need embeddings
-    if not force_regenerate:
-        null_embeddings = conn.execute("""
-            SELECT COUNT(*) FROM topics WHERE embedding IS NULL
-        """).fetchone()[0]
+    refreshed = refresh_search_text(conn)
+    if refreshed:
+        print(f"  📝 Refreshed search text for {refreshed:,} topics")
+
+    # Unless regenerating, only topics without an embedding or whose text
+    # changed since it was embedded are fetched (qualified so it can also be
+    # used in joins against checkpoint data)
+    pending_filter = (
+        "TRUE"
+        if force_regenerate
+        else """
+            topics.embedding IS NULL 
+            OR topics.text_hash IS DISTINCT FROM hash(topics.search_text)
+        """
+    )
 
-        if null_embeddings == 0:
-            print("  ⏭️  All topics already have embeddings (use --force to regenerate)")
-            return
-        else:
-            print(f"  📊 {null_embeddings:,} topics need embeddings")
-    else:
+    # Each batch is saved as a Parquet part before it is applied and deleted
+    # once the UPDATE goes through, so a killed run can be resumed without
+    # calling the API again for batches it embedded but never applied
+    part_number = 0
+    if checkpoint_dir is not None:
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        existing_parts = sorted(checkpoint_dir.glob("part-*.parquet"))
+
+        if force_regenerate:
+            for part_path in existing_parts:
+                part_path.unlink()
+            print(f"  🗑️  Cleared {len(existing_parts)} checkpoint parts")
+        elif existing_parts:
+            restored = restore_checkpoints(conn, checkpoint_dir, pending_filter)
+            print(f"  ♻️  Restored {restored:,} embeddings from {checkpoint_dir}")
+
+            # Parts that weren't restored hold embeddings of stale text
+            for part_path in existing_parts:
+                part_path.unlink()
+
+    total_count = conn.execute(
+        f"SELECT COUNT(*) FROM topics WHERE {pending_filter}"
+    ).fetchone()[0]
+
+    if force_regenerate:
         print("  🔄 Regenerating all embeddings...")
+    elif total_count == 0:
+        print("  ⏭️  All topics already have embeddings (use --force to regenerate)")
+        return
+    else:
+        print(f"  📊 {total_count:,} topics need embeddings")
 
-    # Get total count for progress tracking
-    total_count = conn.execute("SELECT COUNT(*) FROM topics").fetchone()[0]
     num_batches = (total_count + batch_size - 1) // batch_size
 
     print(
         f"  📦 Processing {total_count:,} topics in {num_batches} batches of {batch_size}"
     )
 
-    start_time = time.time()
+    start_time = time.perf_counter()
     processed = 0
 
-    # Process in batches
-    for i in range(num_batches):
-        batch_start = time.time()
-        offset = i * batch_size
-
-        print(f"    📦 Processing batch {i + 1}/{num_batches} (offset: {offset:,})")
+    # Three-stage pipeline so the database never waits on the API and vice
+    # versa: a reader thread fetches batches, this thread calls Gemini, and a
+    # writer thread applies the UPDATEs. Bounded queues cap memory use; each
+    # thread gets its own cursor since a DuckDB connection isn't shared safely.
+    fetch_queue: queue.Queue = queue.Queue(maxsize=2)
+    write_queue: queue.Queue = queue.Queue(maxsize=2)
+    stop_reading = threading.Event()
 
-        # Get topics data for this batch
-        topics_data = conn.execute(f"""
-            SELECT 
-                id,
-                display_name,
-                description,
-                subfield,
-                field,
-                domain
-            FROM topics 
-            ORDER BY id
-            LIMIT {batch_size} OFFSET {offset}
-        """).fetchall()
-
-        if not topics_data:
-            break
-
-        # Format text for each topic
-        topic_texts = []
-        topic_ids = []
-
-        for topic in topics_data:
-            topic_dict = {
-                "display_name": topic[1],
-                "description": topic[2],
-                "subfield": topic[3],
-                "field": topic[4],
-                "domain": topic[5],
-            }
-
-            formatted_text = format_topic_text(topic_dict)
-            topic_texts.append(formatted_text)
-            topic_ids.append(topic[0])
-
-        # Generate embeddings and update database
+    def read_batches(cursor: duckdb.DuckDBPyConnection) -> None:
+        """Stream pending topics as Arrow record batches into fetch_queue"""
         try:
-            # Generate embeddings using Gemini
-            embeddings = generate_gemini_embeddings(client, topic_texts)
-
-            # Update each topic individually to avoid SQL injection issues
-            for topic_id, embedding in zip(topic_ids, embeddings):
-                conn.execute(
-                    "UPDATE topics SET embedding = ? WHERE id = ?",
-                    [embedding, topic_id],
+            reader = cursor.execute(f"""
+                SELECT 
+                    id,
+                    search_text AS text,
+                    hash(search_text) AS text_hash
+                FROM topics 
+                WHERE {pending_filter}
+                ORDER BY id
+            """).fetch_record_batch(batch_size)
+
+            for batch in reader:
+                if stop_reading.is_set():
+                    break
+                fetch_queue.put(
+                    (
+                        batch.column("id").to_pylist(),
+                        batch.column("text").to_pylist(),
+                        batch.column("text_hash").to_pylist(),
+                    )
                 )
+        except Exception as e:
+            print(f"      ❌ Error reading topics: {e}")
+        finally:
+            fetch_queue.put(None)
 
-            processed += len(topics_data)
-            batch_duration = time.time() - batch_start
+    def write_batches(cursor: duckdb.DuckDBPyConnection) -> None:
+        """Apply embedding batches from write_queue with bulk UPDATEs"""
+        nonlocal processed, part_number
+        last_print = start_time
 
+        while (item := write_queue.get()) is not None:
+            batch_number, topic_ids, text_hashes, embeddings = item
+            try:
+                batch_table = build_embeddings_table(topic_ids, text_hashes, embeddings)
+
+                part_path = None
+                if checkpoint_dir is not None:
+                    part_path = write_checkpoint(
+                        checkpoint_dir, part_number, batch_table
+                    )
+                    part_number += 1
+
+                # Write the whole batch in one statement
+                update_topic_embeddings(cursor, batch_table)
+
+                if part_path is not None:
+                    part_path.unlink()
+            except Exception as e:
+                print(f"      ❌ Error writing batch {batch_number}: {e}")
+                continue
+
+            processed += len(topic_ids)
+
+            # Report every PROGRESS_EVERY_BATCHES batches or PROGRESS_INTERVAL
+            # seconds rather than per batch
+            now = time.perf_counter()
+            if (
+                batch_number % PROGRESS_EVERY_BATCHES
+                and batch_number != num_batches
+                and now - last_print < PROGRESS_INTERVAL
+            ):
+                continue
+            last_print = now
+
+            rate = processed / (now - start_time)
+            eta = (total_count - processed) / rate if rate else 0
             print(
-                f"      ✅ Updated {len(topics_data)} topics in {batch_duration:.2f}s"
+                f"    📈 Batch {batch_number}/{num_batches}: {processed:,}/{total_count:,} "
+                f"({processed / total_count * 100:.1f}%), {rate:.0f} topics/s, ETA {eta:.0f}s"
             )
-            print(
-                f"      📈 Progress: {processed:,}/{total_count:,} ({processed / total_count * 100:.1f}%)"
+
+    reader_thread = threading.Thread(target=read_batches, args=(conn.cursor(),))
+    writer_thread = threading.Thread(target=write_batches, args=(conn.cursor(),))
+    reader_thread.start()
+    writer_thread.start()
+
+    item = ()
+
+    # Enough batches in flight to fill every request slot, plus one so the
+    # next batch is ready when a slot frees up
+    max_batches_in_flight = (
+        -(-GEMINI_MAX_CONCURRENT_REQUESTS * GEMINI_MAX_BATCH_SIZE // batch_size) + 1
+    )
+
+    async def embed_batches() -> None:
+        """Embed batches from fetch_queue and hand them to the writer"""
+        nonlocal item
+        semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENT_REQUESTS)
+        in_flight: set[asyncio.Task] = set()
+        batch_number = 0
+
+        async def embed_batch(
+            batch_number: int,
+            topic_ids: List[str],
+            topic_texts: List[str],
+            text_hashes: List[int],
+        ) -> None:
+            try:
+                # Generate embeddings using Gemini
+                embeddings = await generate_gemini_embeddings(
+                    client, topic_texts, semaphore
+                )
+            except Exception as e:
+                print(f"      ❌ Error processing batch {batch_number}: {e}")
+                return
+
+            await asyncio.to_thread(
+                write_queue.put, (batch_number, topic_ids, text_hashes, embeddings)
             )
 
-        except Exception as e:
-            print(f"      ❌ Error processing batch {i + 1}: {e}")
-            continue
+        # Queue operations block, so they run off the event loop
+        while (item := await asyncio.to_thread(fetch_queue.get)) is not None:
+            batch_number += 1
+            in_flight.add(asyncio.create_task(embed_batch(batch_number, *item)))
+
+            # Batches overlap, but only this many are held in memory at once
+            if len(in_flight) >= max_batches_in_flight:
+                _, in_flight = await asyncio.wait(
+                    in_flight, return_when=asyncio.FIRST_COMPLETED
+                )
 
-    total_duration = time.time() - start_time
+        await asyncio.gather(*in_flight)
+
+    try:
+        asyncio.run(embed_batches())
+    finally:
+        write_queue.put(None)
+
+        # If we stopped early, drain fetch_queue so the reader can't block on it
+        stop_reading.set()
+        while item is not None:
+            item = fetch_queue.get()
+
+        reader_thread.join()
+        writer_thread.join()
+
+    total_duration = time.perf_counter() - start_time
     print(f"  ✅ Embedding generation completed in {total_duration:.2f}s")
     print(f"  📈 Rate: {processed / total_duration:.0f} topics/second")
 
@@ -378,7 +620,50 @@ def generate_embeddings(
     print(f"  📊 Final count: {embedded_count:,} topics with embeddings")
 
 
-def test_search_functionality(conn: duckdb.DuckDBPyConnection) -> None:
+def drop_hnsw_index(conn: duckdb.DuckDBPyConnection) -> None:
+    """Drop the HNSW index so embedding columns can be rewritten or dropped"""
+    try:
+        conn.execute("DROP INDEX IF EXISTS hnsw_topic_embeddings")
+    except Exception as e:
+        print(f"  ⚠️  Warning dropping HNSW index: {e}")
+
+
+def create_hnsw_index(conn: duckdb.DuckDBPyConnection) -> None:
+    """Create HNSW index on topic embeddings for fast similarity search"""
+    print("🔗 Creating HNSW index...")
+
+    try:
+        # Always drop existing index to ensure it's fresh
+        drop_hnsw_index(conn)
+
+        # Required for HNSW indexes in a file-backed database
+        conn.execute("SET hnsw_enable_experimental_persistence = true")
+
+        print("  🔨 Building HNSW index...")
+        start_time = time.time()
+
+        conn.execute(f"""
+            CREATE INDEX hnsw_topic_embeddings 
+            ON topics 
+            USING HNSW (embedding) 
+            WITH (
+                metric = 'cosine',
+                M = {HNSW_M},
+                ef_construction = {HNSW_EF_CONSTRUCTION}
+            )
+        """)
+
+        duration = time.time() - start_time
+        print(f"  ✅ HNSW index created in {duration:.2f}s")
+
+    except Exception as e:
+        print(f"  ❌ Error creating HNSW index: {e}")
+        print("  💡 Note: HNSW might not be available in your DuckDB version")
+
+
+def test_search_functionality(
+    conn: duckdb.DuckDBPyConnection, client: genai.Client
+) -> None:
     """Test both FTS and semantic search"""
     print("🧪 Testing search functionality...")
 
@@ -387,101 +672,134 @@ def test_search_functionality(conn: duckdb.DuckDBPyConnection) -> None:
     try:
         # Test FTS
         print(f"  🔍 Testing FTS with query: '{test_query}'")
-        fts_results = conn.execute(f"""
+        fts_results = conn.execute(
+            """
             SELECT 
                 id,
                 display_name,
-                fts_main_topics.match_bm25(id, '{test_query}') as bm25_score
+                fts_main_topics.match_bm25(id, ?) as bm25_score
             FROM topics 
             WHERE bm25_score > 0
             ORDER BY bm25_score DESC
             LIMIT 10
-        """).fetchall()
+        """,
+            [test_query],
+        ).fetchall()
 
         print(f"    📊 FTS found {len(fts_results)} results")
         for result in fts_results[:10]:
             print(f"      - {result[1]} (score: {result[2]:.2f})")
 
-        # Test semantic search
-        print(f"  🧠 Testing semantic search with query: '{test_query}'")
+        # Embed the test query once and bind it into every semantic query
+        query_embedding = embed_query(client, test_query)
 
-        # Initialize Gemini client
-        client = initialize_gemini_client()
+        # Test semantic search: ORDER BY cosine distance + LIMIT is the shape
+        # VSS answers from the HNSW index instead of scanning every row
+        print(f"  🧠 Testing semantic (HNSW) search with query: '{test_query}'")
 
-        # Generate embedding for the test query
-        query_embedding = generate_gemini_embeddings(client, [test_query])[0]
-
-        semantic_results = conn.execute(
-            """
+        ann_results = conn.execute(
+            f"""
             SELECT 
                 id,
                 display_name,
-                array_cosine_similarity(embedding, ?::FLOAT[768]) as similarity_score
+                array_cosine_distance(embedding, ?::FLOAT[{EMBEDDING_DIM}]) as distance
             FROM topics 
-            WHERE embedding IS NOT NULL
-            ORDER BY similarity_score DESC
+            ORDER BY distance
             LIMIT 10
         """,
             [query_embedding],
         ).fetchall()
 
-        print(f"    📊 Semantic search found {len(semantic_results)} results")
-        for result in semantic_results[:10]:
-            print(f"      - {result[1]} (similarity: {result[2]:.3f})")
+        print(f"    📊 Semantic search found {len(ann_results)} results")
+        for result in ann_results:
+            print(f"      - {result[1]} (similarity: {1 - result[2]:.3f})")
 
         # Test hybrid search
         print(f"  🔀 Testing hybrid search with query: '{test_query}'")
 
         hybrid_results = conn.execute(
             f"""
+            -- Matching topics only; non-matches never reach the joins below
             WITH fts AS (
+                SELECT id, bm25_score
+                FROM (
+                    SELECT 
+                        id,
+                        fts_main_topics.match_bm25(id, ?) as bm25_score
+                    FROM topics 
+                )
+                WHERE bm25_score > 0
+            ),
+            -- BM25 range over matching rows, computed once for normalization
+            bm25_stats AS (
                 SELECT 
-                    id,
-                    display_name,
-                    fts_main_topics.match_bm25(id, '{test_query}') as bm25_score
-                FROM topics 
+                    MIN(bm25_score) as min_score,
+                    MAX(bm25_score) as max_score
+                FROM fts 
+            ),
+            -- Only the top BM25 matches and the nearest neighbours (answered by
+            -- the HNSW index) are scored exactly, instead of every topic
+            candidates AS (
+                (
+                    SELECT id FROM fts 
+                    ORDER BY bm25_score DESC 
+                    LIMIT {HYBRID_CANDIDATES}
+                )
+                UNION
+                (
+                    SELECT id FROM topics 
+                    ORDER BY array_cosine_distance(embedding, ?::FLOAT[{EMBEDDING_DIM}]) 
+                    LIMIT {HYBRID_CANDIDATES}
+                )
             ),
             semantic AS (
                 SELECT 
-                    id,
-                    display_name,
-                    array_cosine_similarity(embedding, ?::FLOAT[768]) as cosine_score
-                FROM topics 
-                WHERE embedding IS NOT NULL
+                    topics.id,
+                    array_cosine_similarity(topics.embedding, ?::FLOAT[{EMBEDDING_DIM}]) as cosine_score
+                FROM candidates
+                JOIN topics ON topics.id = candidates.id
+                WHERE topics.embedding IS NOT NULL
             ),
             normalized_scores AS (
                 SELECT 
-                    COALESCE(fts.id, semantic.id) as id,
-                    COALESCE(fts.display_name, semantic.display_name) as display_name,
+                    semantic.id,
                     COALESCE(fts.bm25_score, 0) as raw_bm25_score,
                     COALESCE(semantic.cosine_score, 0) as raw_cosine_score,
-                    -- Min-max normalization for BM25 scores
-                    CASE 
-                        WHEN (SELECT MAX(bm25_score) FROM fts WHERE bm25_score > 0) - (SELECT MIN(bm25_score) FROM fts WHERE bm25_score > 0) = 0 
-                        THEN 0
-                        ELSE (COALESCE(fts.bm25_score, 0) - (SELECT MIN(bm25_score) FROM fts WHERE bm25_score > 0)) / 
-                             NULLIF((SELECT MAX(bm25_score) FROM fts WHERE bm25_score > 0) - (SELECT MIN(bm25_score) FROM fts WHERE bm25_score > 0), 0)
-                    END as norm_bm25_score,
+                    -- Min-max normalization for BM25 scores (0 when the range is empty)
+                    COALESCE(
+                        (COALESCE(fts.bm25_score, 0) - bm25_stats.min_score) / 
+                        NULLIF(bm25_stats.max_score - bm25_stats.min_score, 0),
+                        0
+                    ) as norm_bm25_score,
                     -- Cosine similarity is already normalized [0,1], but ensure it's positive
                     GREATEST(COALESCE(semantic.cosine_score, 0), 0) as norm_cosine_score
-                FROM fts
-                FULL OUTER JOIN semantic ON fts.id = semantic.id
+                FROM semantic
+                LEFT JOIN fts ON fts.id = semantic.id
+                CROSS JOIN bm25_stats
             )
             SELECT 
-                id,
-                display_name,
+                scores.id,
+                topics.display_name,
                 raw_bm25_score,
                 raw_cosine_score,
                 norm_bm25_score,
                 norm_cosine_score,
-                -- Convex combination: 0.1 * BM25 + 0.9 * cosine similarity
-                (0.1 * norm_bm25_score + 0.9 * norm_cosine_score) AS hybrid_score
-            FROM normalized_scores
-            WHERE (raw_bm25_score > 0 OR raw_cosine_score > 0)
+                hybrid_score
+            FROM (
+                SELECT 
+                    *,
+                    -- Convex combination: 0.1 * BM25 + 0.9 * cosine similarity
+                    (0.1 * norm_bm25_score + 0.9 * norm_cosine_score) AS hybrid_score
+                FROM normalized_scores
+                WHERE (raw_bm25_score > 0 OR raw_cosine_score > 0)
+                ORDER BY hybrid_score DESC
+                LIMIT 10
+            ) scores
+            -- display_name is looked up once, for the final rows only
+            JOIN topics ON topics.id = scores.id
             ORDER BY hybrid_score DESC
-            LIMIT 10
         """,
-            [query_embedding],
+            [test_query, query_embedding, query_embedding],
         ).fetchall()
 
         print(f"    📊 Hybrid search found {len(hybrid_results)} results")
@@ -511,6 +829,13 @@ Examples:
     
     # Use smaller batch size for embeddings
     python prepare_topics_search.py --batch-size 500
+    
+    # Skip HNSW index if not supported
+    python prepare_topics_search.py --skip-hnsw
+    
+    # Leave cores free for other work (the FTS build and HNSW index scale
+    # with threads, within --memory-limit)
+    python prepare_topics_search.py --threads 4 --memory-limit 8GB
         """,
     )
 
@@ -524,8 +849,8 @@ Examples:
     parser.add_argument(
         "--batch-size",
         type=int,
-        default=100,
-        help="Batch size for embedding generation (default: 100)",
+        default=1000,
+        help=f"Topics per database batch, sent to Gemini in requests of {GEMINI_MAX_BATCH_SIZE} (default: 1000)",
     )
 
     parser.add_argument(
@@ -540,6 +865,32 @@ Examples:
         help="Only test search functionality, do not create indexes or embeddings",
     )
 
+    parser.add_argument(
+        "--checkpoint-dir",
+        type=str,
+        help="Directory for Parquet embedding checkpoints (default: <db name>_topic_embeddings next to the database)",
+    )
+
+    parser.add_argument(
+        "--memory-limit",
+        type=str,
+        default="12GB",
+        help="DuckDB memory limit (default: 12GB)",
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=os.cpu_count(),
+        help="DuckDB worker threads (default: number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--skip-hnsw",
+        action="store_true",
+        help="Skip creating HNSW index (useful if not supported)",
+    )
+
     args = parser.parse_args()
 
     # Resolve database path
@@ -550,17 +901,42 @@ Examples:
         print("💡 Run setup_database.py and migrate_from_parquet.py first")
         sys.exit(1)
 
+    if args.checkpoint_dir:
+        checkpoint_dir = Path(args.checkpoint_dir).resolve()
+    else:
+        checkpoint_dir = db_path.with_name(f"{db_path.stem}_topic_embeddings")
+
     print("DuckDB Topics Search Preparation")
     print("=" * 40)
     print(f"Database file: {db_path}")
     print(f"Database size: {db_path.stat().st_size:,} bytes")
     print(f"Batch size: {args.batch_size:,}")
     print(f"Force rebuild: {args.force}")
+    print(f"Skip HNSW: {args.skip_hnsw}")
+    print(f"Memory limit: {args.memory_limit}")
+    print(f"Threads: {args.threads}")
+    print(f"Checkpoint directory: {checkpoint_dir}")
 
     # Connect to database
     try:
         conn = duckdb.connect(str(db_path))
         print("✅ Connected to database")
+
+        # Configure DuckDB to spill instead of running out of memory during the
+        # bulk embedding UPDATEs and the HNSW build
+        temp_dir = tempfile.mkdtemp(prefix="duckdb_temp_")
+        print(f"🗂️  Using temporary directory: {temp_dir}")
+
+        conn.execute(f"SET memory_limit='{args.memory_limit}';")
+        conn.execute(f"SET temp_directory='{temp_dir}';")
+        conn.execute("SET preserve_insertion_order=false;")
+        conn.execute("SET max_temp_directory_size='20GB';")
+
+        # Tokenizing for the FTS index and building the HNSW graph use all threads
+        conn.execute(f"SET threads={args.threads};")
+
+        print("⚙️  Configured DuckDB memory and thread settings")
+
     except Exception as e:
         print(f"❌ Failed to connect to database: {e}")
         sys.exit(1)
@@ -575,9 +951,21 @@ Examples:
             print("❌ Topics table not found. Run migration first.")
             sys.exit(1)
 
+        # One Gemini client is shared by embedding generation and search tests
+        print("📥 Initializing Gemini client...")
+        client = initialize_gemini_client()
+        print("✅ Gemini client initialized")
+
         if args.test_only:
-            test_search_functionality(conn)
+            test_search_functionality(conn, client)
         else:
+            # The HNSW index is rebuilt once embeddings are written; dropping it
+            # first avoids maintaining it row by row and allows dropping columns
+            drop_hnsw_index(conn)
+
+            for column_name in LEGACY_EMBEDDING_COLUMNS:
+                conn.execute(f"ALTER TABLE topics DROP COLUMN IF EXISTS {column_name}")
+
             # Add embedding column if needed
             if not table_info["has_embedding"] or args.force:
                 add_embedding_column(conn, force_rebuild=args.force)
@@ -587,11 +975,19 @@ Examples:
 
             # Generate embeddings
             generate_embeddings(
-                conn, batch_size=args.batch_size, force_regenerate=args.force
+                conn,
+                client,
+                batch_size=args.batch_size,
+                force_regenerate=args.force,
+                checkpoint_dir=checkpoint_dir,
             )
 
+            # Create HNSW index (if not skipped)
+            if not args.skip_hnsw:
+                create_hnsw_index(conn)
+
             # Test functionality
-            test_search_functionality(conn)
+            test_search_functionality(conn, client)
 
             print("\n🎉 Topics search preparation completed!")
             print("💡 You can now use both full-text and semantic search on topics")
@@ -12,19 +12,64 @@ Usage:
 """
 
 import argparse
+import os
+import queue
 import sys
+import tempfile
+import threading
 from pathlib import Path
 import duckdb
 import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import torch
 from sentence_transformers import SentenceTransformer
 from typing import List
 
+# Work titles are short; capping the tokenized length keeps a few very long
+# titles from padding whole encode batches out to the model's limit
+MAX_SEQ_LENGTH = 64
+
+# Texts per forward pass; the encode default of 32 splits a database batch
+# into hundreds of small GPU launches
+ENCODE_BATCH_SIZE = 512
+
+# HNSW graph parameters tuned for normalized 384-d title embeddings: more
+# neighbours and a wider build candidate list for recall, a smaller search
+# candidate list for query speed
+HNSW_M = 24
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 40
+
 
 def get_script_dir() -> Path:
     """Get the directory where this script is located"""
     return Path(__file__).parent.absolute()
 
 
+def get_device() -> str:
+    """Pick the torch device for the embedding model: MPS, then CUDA, then CPU"""
+    if torch.backends.mps.is_available():
+        return "mps"
+    if torch.cuda.is_available():
+        return "cuda"
+    return "cpu"
+
+
+def load_model(model_name: str, half_precision: bool = False) -> SentenceTransformer:
+    """Load the SentenceTransformer model once for embedding and search tests"""
+    device = get_device()
+    print(f"📥 Loading SentenceTransformer model: {model_name} ({device})")
+    model = SentenceTransformer(model_name, device=device)
+    model.max_seq_length = min(model.max_seq_length, MAX_SEQ_LENGTH)
+    if half_precision:
+        model.half()
+    print(f"✅ Model loaded ({model_name}{', fp16' if half_precision else ''})")
+    print(f"📏 Using model with {model.get_sentence_embedding_dimension()} dimensions")
+    return model
+
+
 def initialize_extensions(conn: duckdb.DuckDBPyConnection) -> None:
     """Initialize FTS and VSS extensions"""
     print("🔧 Installing and loading extensions...")
@@ -45,34 +90,32 @@ def initialize_extensions(conn: duckdb.DuckDBPyConnection) -> None:
         raise
 
 
-def check_works_table(conn: duckdb.DuckDBPyConnection) -> dict:
+def check_works_table(conn: duckdb.DuckDBPyConnection, verify: bool = False) -> dict:
     """Check if works table exists and get statistics"""
     print("📊 Checking works table...")
 
     try:
-        # Check if table exists
-        result = conn.execute("""
-            SELECT table_name 
-            FROM information_schema.tables 
-            WHERE table_name = 'works' AND table_schema = 'main'
-        """).fetchone()
+        # Both tables are looked up in one catalog query; the row count is
+        # DuckDB's estimate, so no scan of works is needed
+        estimated_sizes = dict(
+            conn.execute("""
+                SELECT table_name, estimated_size
+                FROM duckdb_tables()
+                WHERE schema_name = 'main' 
+                    AND table_name IN ('works', 'work_display_name_embeddings')
+            """).fetchall()
+        )
 
-        if not result:
+        if "works" not in estimated_sizes:
             print("  ❌ Works table not found")
             return {"exists": False}
 
-        # Get row count
-        count_result = conn.execute("SELECT COUNT(*) FROM works").fetchone()
-        row_count = count_result[0] if count_result else 0
+        row_count = estimated_sizes["works"]
+        if verify or row_count is None:
+            # Exact count is a full scan, only done when asked for
+            row_count = conn.execute("SELECT COUNT(*) FROM works").fetchone()[0]
 
-        # Check if embeddings table exists
-        embeddings_result = conn.execute("""
-            SELECT table_name 
-            FROM information_schema.tables 
-            WHERE table_name = 'work_display_name_embeddings' AND table_schema = 'main'
-        """).fetchone()
-
-        has_embeddings_table = embeddings_result is not None
+        has_embeddings_table = "work_display_name_embeddings" in estimated_sizes
 
         print(f"  📋 Works table found with {row_count:,} rows")
         print(f"  🔍 Embeddings table exists: {has_embeddings_table}")
@@ -115,12 +158,9 @@ def create_embeddings_table(
         """)
         print(f"  ✅ Embeddings table created (dimensions: {embedding_dim})")
 
-        # Create index on work_id for fast lookups
-        conn.execute("""
-            CREATE INDEX IF NOT EXISTS idx_work_embeddings_work_id 
-            ON work_display_name_embeddings(work_id)
-        """)
-        print("  ✅ Work ID index created")
+        # The primary key already indexes work_id; drop the redundant index
+        # earlier versions created so bulk inserts maintain only one
+        conn.execute("DROP INDEX IF EXISTS idx_work_embeddings_work_id")
 
     except Exception as e:
         if "already exists" in str(e).lower():
@@ -197,89 +237,123 @@ def create_fts_index(
         raise
 
 
-def format_work_text(display_name: str) -> str:
-    """Format work display_name for embedding generation"""
-    if not display_name:
-        return ""
+def write_embedding_shard(
+    shard_dir: Path, part_number: int, work_ids: List[str], embeddings: np.ndarray
+) -> None:
+    """Write a batch of embeddings to a Parquet shard for the final bulk load"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    batch_table = pa.table(
+        {
+            "work_id": pa.array(work_ids, type=pa.string()),
+            "embedding": pa.FixedSizeListArray.from_arrays(
+                embeddings.ravel(), embeddings.shape[1]
+            ),
+        }
+    )
 
-    # Simple formatting - just use the display name as is
-    # Could be enhanced to include title variations or other metadata
-    return f"WORK: {display_name.strip()}"
+    part_path = shard_dir / f"part-{part_number:06d}.parquet"
+    tmp_path = part_path.with_suffix(".parquet.tmp")
+
+    # Write then rename so an interrupted run never leaves a truncated shard
+    pq.write_table(batch_table, tmp_path, compression="zstd", compression_level=1)
+    os.replace(tmp_path, part_path)
+
+
+def load_embedding_shards(conn: duckdb.DuckDBPyConnection, shard_dir: Path) -> int:
+    """Bulk load every Parquet shard in one INSERT, delete the shards and return the rows inserted"""
+    shard_paths = sorted(shard_dir.glob("part-*.parquet"))
+    if not shard_paths:
+        return 0
+
+    # Each work lands in exactly one shard: shards are loaded before the todo
+    # table is built and deleted right after. OR REPLACE only covers a run
+    # killed between the INSERT and the unlinks.
+    loaded = conn.execute(f"""
+        INSERT OR REPLACE INTO work_display_name_embeddings (work_id, embedding)
+        SELECT work_id, embedding
+        FROM read_parquet('{shard_dir / "part-*.parquet"}', union_by_name = true)
+    """).fetchone()[0]
+
+    for shard_path in shard_paths:
+        shard_path.unlink()
+
+    return loaded
 
 
 def generate_embeddings(
     conn: duckdb.DuckDBPyConnection,
+    model: SentenceTransformer,
+    shard_dir: Path,
     batch_size: int = 10_000,
     force_regenerate: bool = False,
-    model_name: str = "all-MiniLM-L6-v2",
 ) -> None:
     """Generate embeddings for all works and store in separate table"""
     print("🧠 Generating work embeddings...")
 
-    # Initialize sentence transformer model
-    print(f"  📥 Loading SentenceTransformer model: {model_name}")
-    model = SentenceTransformer(model_name, device="mps")
-    print(f"  ✅ Model loaded ({model_name})")
-
-    # Get model dimensions for validation
-    model_dim = model.get_sentence_embedding_dimension()
-    print(f"  📏 Model dimensions: {model_dim}")
-
-    # Check how many works need embeddings
-    if not force_regenerate:
-        # Count works that don't have embeddings yet
-        missing_embeddings = conn.execute("""
-            SELECT COUNT(*) FROM works w
-            WHERE NOT EXISTS (
-                SELECT 1 FROM work_display_name_embeddings e 
-                WHERE e.work_id = w.id
-            )
-        """).fetchone()[0]
+    # Batches are staged as Parquet shards and loaded with a single INSERT at
+    # the end; shards left behind by a killed run are loaded before starting
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    existing_shards = sorted(shard_dir.glob("part-*.parquet"))
 
-        if missing_embeddings == 0:
-            print("  ⏭️  All works already have embeddings (use --force to regenerate)")
-            return
-        else:
-            print(f"  📊 {missing_embeddings:,} works need embeddings")
-    else:
+    if force_regenerate:
         print("  🔄 Regenerating all embeddings...")
-        # Clear existing embeddings if regenerating
+        # Clear existing embeddings and stale shards if regenerating
         conn.execute("DELETE FROM work_display_name_embeddings")
+        for shard_path in existing_shards:
+            shard_path.unlink()
+    elif existing_shards:
+        loaded = load_embedding_shards(conn, shard_dir)
+        print(
+            f"  ♻️  Loaded {loaded:,} embeddings from {len(existing_shards)} shards of an earlier run"
+        )
 
-    # Register embedding function
-    def get_text_embedding_list(text_list: List[str]) -> List[List[float]]:
-        """Generate embeddings for a list of texts"""
-        embeddings = model.encode(text_list, normalize_embeddings=True)
-        return embeddings.tolist()
-
-    conn.create_function(
-        "get_text_embedding_list",
-        get_text_embedding_list,
-        return_type=f"FLOAT[{model_dim}][]",
-    )
+    # Collect the works still missing embeddings with a single anti-join; the
+    # reader then scans this table. Temp tables belong to the cursor that
+    # creates them, so it is built on the cursor the reader thread uses.
+    # The title is embedded as is: the model wasn't trained with a prefix.
+    read_cursor = conn.cursor()
+    read_cursor.execute("""
+        CREATE OR REPLACE TEMP TABLE work_embedding_todo AS
+        SELECT w.id, trim(w.display_name) AS text
+        FROM works w
+        ANTI JOIN work_display_name_embeddings e ON e.work_id = w.id
+        WHERE w.display_name IS NOT NULL
+    """)
+    total_count = read_cursor.execute(
+        "SELECT COUNT(*) FROM work_embedding_todo"
+    ).fetchone()[0]
+
+    if total_count == 0:
+        print("  ⏭️  All works already have embeddings (use --force to regenerate)")
+        read_cursor.close()
+        return
+    elif not force_regenerate:
+        print(f"  📊 {total_count:,} works need embeddings")
+
+    def get_text_embedding_list(text_list: List[str]) -> np.ndarray:
+        """Generate float32 embeddings for a list of texts, one row per text"""
+        # Titles such as "Introduction" or "Editorial" repeat a lot; encode each
+        # distinct text once and fan the result back out to every row
+        unique_texts, inverse = np.unique(text_list, return_inverse=True)
+
+        with torch.inference_mode():
+            embeddings = model.encode(
+                unique_texts.tolist(),
+                batch_size=ENCODE_BATCH_SIZE,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+                pool=pool,
+            )
+        return embeddings.astype(np.float32, copy=False)[inverse]
 
-    # Get total count for progress tracking
-    if force_regenerate:
-        total_count = conn.execute("SELECT COUNT(*) FROM works").fetchone()[0]
-        base_query = "SELECT id, display_name FROM works WHERE display_name IS NOT NULL"
-    else:
-        total_count = conn.execute("""
-            SELECT COUNT(*) FROM works w
-            WHERE w.display_name IS NOT NULL
-                AND NOT EXISTS (
-                    SELECT 1 FROM work_display_name_embeddings e 
-                    WHERE e.work_id = w.id
-                )
-        """).fetchone()[0]
-        base_query = """
-            SELECT w.id, w.display_name 
-            FROM works w
-            WHERE w.display_name IS NOT NULL
-                AND NOT EXISTS (
-                    SELECT 1 FROM work_display_name_embeddings e 
-                    WHERE e.work_id = w.id
-                )
-        """
+    # Without a GPU a single process leaves most cores idle, so encoding is
+    # spread over one worker process per spare core
+    pool = None
+    if model.device.type == "cpu":
+        workers = max(1, (os.cpu_count() or 1) - 1)
+        pool = model.start_multi_process_pool(["cpu"] * workers)
+        print(f"  🧵 Encoding on {workers} CPU worker processes")
 
     num_batches = (total_count + batch_size - 1) // batch_size
 
@@ -290,96 +364,140 @@ def generate_embeddings(
     start_time = time.time()
     processed = 0
 
-    # Process in batches
-    for i in range(num_batches):
-        batch_start = time.time()
-        offset = i * batch_size
+    # Three-stage pipeline so the GPU never waits on the database and vice
+    # versa: a reader thread streams batches, this thread runs the model, and
+    # a writer thread stages the results as Parquet. Bounded queues cap memory
+    # use; the reader gets its own cursor since a DuckDB connection isn't
+    # shared safely.
+    fetch_queue: queue.Queue = queue.Queue(maxsize=2)
+    write_queue: queue.Queue = queue.Queue(maxsize=2)
+    stop_reading = threading.Event()
+
+    def read_batches(cursor: duckdb.DuckDBPyConnection) -> None:
+        """Stream pending works as Arrow record batches into fetch_queue"""
+        try:
+            # One streaming scan instead of re-running a query with LIMIT/OFFSET
+            reader = cursor.execute(
+                "SELECT id, text FROM work_embedding_todo"
+            ).fetch_record_batch(batch_size)
+
+            for batch in reader:
+                if stop_reading.is_set():
+                    break
+
+                work_ids = batch.column("id").to_pylist()
+                work_texts = batch.column("text").to_pylist()
+                fetch_queue.put((work_ids, work_texts))
+        except Exception as e:
+            print(f"      ❌ Error reading works: {e}")
+        finally:
+            fetch_queue.put(None)
 
-        print(f"    📦 Processing batch {i + 1}/{num_batches} (offset: {offset:,})")
+    def write_batches() -> None:
+        """Write embedding batches from write_queue to Parquet shards"""
+        nonlocal processed
 
-        # Get works data for this batch
-        works_data = conn.execute(f"""
-            {base_query}
-            ORDER BY id
-            LIMIT {batch_size} OFFSET {offset}
-        """).fetchall()
+        while (item := write_queue.get()) is not None:
+            batch_number, work_ids, embeddings, batch_start = item
+            try:
+                write_embedding_shard(shard_dir, batch_number, work_ids, embeddings)
+            except Exception as e:
+                print(f"      ❌ Error writing batch {batch_number}: {e}")
+                continue
 
-        if not works_data:
-            break
+            processed += len(work_ids)
+            batch_duration = time.time() - batch_start
 
-        # Format text for each work and prepare for batch insert
-        work_texts = []
-        work_ids = []
-        insert_values = []
+            print(f"      ✅ Staged {len(work_ids)} works in {batch_duration:.2f}s")
+            print(
+                f"      📈 Progress: {processed:,}/{total_count:,} ({processed / total_count * 100:.1f}%)"
+            )
 
-        for work in works_data:
-            work_id = work[0]
-            display_name = work[1]
+    reader_thread = threading.Thread(target=read_batches, args=(read_cursor,))
+    writer_thread = threading.Thread(target=write_batches)
+    reader_thread.start()
+    writer_thread.start()
 
-            formatted_text = format_work_text(display_name)
-            work_texts.append(formatted_text)
-            work_ids.append(work_id)
+    # Process in batches
+    batch_number = 0
+    item = ()
+    try:
+        while (item := fetch_queue.get()) is not None:
+            batch_start = time.time()
+            batch_number += 1
+            work_ids, work_texts = item
 
-        # Generate embeddings and prepare batch insert
-        try:
-            # Generate embeddings first
-            embeddings = get_text_embedding_list(work_texts)
+            print(f"    📦 Processing batch {batch_number}/{num_batches}")
 
-            # Prepare batch insert values
-            for work_id, embedding in zip(work_ids, embeddings):
-                insert_values.append((work_id, embedding))
+            try:
+                embeddings = get_text_embedding_list(work_texts)
+            except Exception as e:
+                print(f"      ❌ Error processing batch {batch_number}: {e}")
+                continue
 
-            # Batch insert into embeddings table
-            conn.executemany(
-                "INSERT OR REPLACE INTO work_display_name_embeddings (work_id, embedding) VALUES (?, ?)",
-                insert_values,
-            )
+            write_queue.put((batch_number, work_ids, embeddings, batch_start))
+    finally:
+        write_queue.put(None)
 
-            processed += len(works_data)
-            batch_duration = time.time() - batch_start
+        # If we stopped early, drain fetch_queue so the reader can't block on it
+        stop_reading.set()
+        while item is not None:
+            item = fetch_queue.get()
 
-            print(f"      ✅ Updated {len(works_data)} works in {batch_duration:.2f}s")
-            print(
-                f"      📈 Progress: {processed:,}/{total_count:,} ({processed / total_count * 100:.1f}%)"
-            )
+        reader_thread.join()
+        writer_thread.join()
 
-        except Exception as e:
-            print(f"      ❌ Error processing batch {i + 1}: {e}")
-            continue
+        read_cursor.execute("DROP TABLE IF EXISTS work_embedding_todo")
+        read_cursor.close()
+
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
 
     total_duration = time.time() - start_time
     print(f"  ✅ Embedding generation completed in {total_duration:.2f}s")
     print(f"  📈 Rate: {processed / total_duration:.0f} works/second")
 
-    # Verify embeddings were created
-    embedded_count = conn.execute("""
-        SELECT COUNT(*) FROM work_display_name_embeddings
-    """).fetchone()[0]
+    print("  📥 Loading embedding shards...")
+    load_start = time.time()
+    loaded = load_embedding_shards(conn, shard_dir)
+    print(f"  ✅ Loaded {loaded:,} embeddings in {time.time() - load_start:.2f}s")
+
 
-    print(f"  📊 Final count: {embedded_count:,} works with embeddings")
+def drop_hnsw_index(conn: duckdb.DuckDBPyConnection) -> None:
+    """Drop the HNSW index so bulk inserts don't maintain it row by row"""
+    try:
+        conn.execute("DROP INDEX IF EXISTS hnsw_work_embeddings")
+    except Exception as e:
+        print(f"  ⚠️  Warning dropping HNSW index: {e}")
 
 
-def create_hnsw_index(conn: duckdb.DuckDBPyConnection) -> None:
+def create_hnsw_index(
+    conn: duckdb.DuckDBPyConnection,
+    m: int = HNSW_M,
+    ef_construction: int = HNSW_EF_CONSTRUCTION,
+) -> None:
     """Create HNSW index on embeddings table for fast similarity search"""
     print("🔗 Creating HNSW index...")
 
     try:
         # Always drop existing index to ensure it's fresh
-        try:
-            conn.execute("DROP INDEX IF EXISTS hnsw_work_embeddings")
-            print("  🗑️  Dropped existing HNSW index")
-        except Exception:
-            pass  # Index might not exist
+        drop_hnsw_index(conn)
 
         # Create HNSW index
-        print("  🔨 Building HNSW index (this may take a while)...")
+        print(
+            f"  🔨 Building HNSW index (M={m}, ef_construction={ef_construction}, this may take a while)..."
+        )
         start_time = time.time()
 
-        conn.execute("""
+        conn.execute(f"""
             CREATE INDEX hnsw_work_embeddings 
             ON work_display_name_embeddings 
             USING HNSW (embedding) 
-            WITH (metric = 'cosine')
+            WITH (
+                metric = 'cosine',
+                M = {m},
+                ef_construction = {ef_construction}
+            )
         """)
 
         duration = time.time() - start_time
@@ -399,7 +517,9 @@ def create_hnsw_index(conn: duckdb.DuckDBPyConnection) -> None:
 
 
 def test_search_functionality(
-    conn: duckdb.DuckDBPyConnection, model_name: str = "all-MiniLM-L6-v2"
+    conn: duckdb.DuckDBPyConnection,
+    model: SentenceTransformer,
+    ef_search: int = HNSW_EF_SEARCH,
 ) -> None:
     """Test both FTS and semantic search"""
     print("🧪 Testing search functionality...")
@@ -409,16 +529,19 @@ def test_search_functionality(
     try:
         # Test FTS
         print(f"  🔍 Testing FTS with query: '{test_query}'")
-        fts_results = conn.execute(f"""
+        fts_results = conn.execute(
+            """
             SELECT 
                 id,
                 display_name,
-                fts_main_works.match_bm25(id, '{test_query}') as bm25_score
+                fts_main_works.match_bm25(id, ?) as bm25_score
             FROM works 
             WHERE bm25_score > 0
             ORDER BY bm25_score DESC
             LIMIT 5
-        """).fetchall()
+        """,
+            [test_query],
+        ).fetchall()
 
         print(f"    📊 FTS found {len(fts_results)} results")
         for result in fts_results:
@@ -427,34 +550,40 @@ def test_search_functionality(
         # Test semantic search
         print(f"  🧠 Testing semantic search with query: '{test_query}'")
 
-        model = SentenceTransformer(model_name, device="mps")
         model_dim = model.get_sentence_embedding_dimension()
 
-        # Register embedding function
-        def get_text_embedding_list(text_list: List[str]) -> List[List[float]]:
-            """Generate embeddings for a list of texts"""
-            embeddings = model.encode(text_list, normalize_embeddings=True)
-            return embeddings.tolist()
-
-        conn.create_function(
-            "get_text_embedding_list",
-            get_text_embedding_list,
-            return_type=f"FLOAT[{model_dim}][]",
+        # Embed the test query once in Python and bind it into every semantic
+        # query; a UDF call in SQL would run the model again for every row
+        query_embedding = (
+            model.encode([test_query], normalize_embeddings=True)[0]
+            .astype(np.float32)
+            .tolist()
         )
 
-        semantic_results = conn.execute(f"""
+        # The HNSW index only serves ORDER BY distance ... LIMIT directly on
+        # the embeddings table, so titles are joined after the top-k
+        conn.execute(f"SET hnsw_ef_search = {ef_search}")
+        semantic_results = conn.execute(
+            f"""
             SELECT 
                 w.id,
                 w.display_name,
-                array_cosine_similarity(
-                    e.embedding,
-                    get_text_embedding_list(['{test_query}'])[1]
-                ) as similarity_score
-            FROM works w
-            JOIN work_display_name_embeddings e ON w.id = e.work_id
-            ORDER BY similarity_score DESC
-            LIMIT 5
-        """).fetchall()
+                1 - nearest.distance as similarity_score
+            FROM (
+                SELECT 
+                    work_id,
+                    array_cosine_distance(
+                        embedding, ?::FLOAT[{model_dim}]
+                    ) as distance
+                FROM work_display_name_embeddings
+                ORDER BY distance
+                LIMIT 5
+            ) nearest
+            JOIN works w ON w.id = nearest.work_id
+            ORDER BY nearest.distance
+        """,
+            [query_embedding],
+        ).fetchall()
 
         print(f"    📊 Semantic search found {len(semantic_results)} results")
         for result in semantic_results:
@@ -463,42 +592,54 @@ def test_search_functionality(
         # Test hybrid search
         print(f"  🔀 Testing hybrid search with query: '{test_query}'")
 
-        hybrid_results = conn.execute(f"""
+        hybrid_results = conn.execute(
+            f"""
+            -- Matching works only; non-matches never reach the join below
             WITH fts AS (
-                SELECT 
-                    id,
-                    display_name,
-                    fts_main_works.match_bm25(id, '{test_query}') as bm25_score
-                FROM works 
+                SELECT *
+                FROM (
+                    SELECT 
+                        id,
+                        display_name,
+                        fts_main_works.match_bm25(id, ?) as bm25_score
+                    FROM works 
+                )
+                WHERE bm25_score > 0
             ),
             semantic AS (
                 SELECT 
                     w.id,
                     w.display_name,
                     array_cosine_similarity(
-                        e.embedding,
-                        get_text_embedding_list(['{test_query}'])[1]
+                        e.embedding, ?::FLOAT[{model_dim}]
                     ) as cosine_score
                 FROM works w
                 JOIN work_display_name_embeddings e ON w.id = e.work_id
             ),
+            -- BM25 range over matching rows, computed once for normalization
+            bm25_stats AS (
+                SELECT 
+                    MIN(bm25_score) as min_score,
+                    MAX(bm25_score) as max_score
+                FROM fts 
+            ),
             normalized_scores AS (
                 SELECT 
                     COALESCE(fts.id, semantic.id) as id,
                     COALESCE(fts.display_name, semantic.display_name) as display_name,
                     COALESCE(fts.bm25_score, 0) as raw_bm25_score,
                     COALESCE(semantic.cosine_score, 0) as raw_cosine_score,
-                    -- Min-max normalization for BM25 scores
-                    CASE 
-                        WHEN (SELECT MAX(bm25_score) FROM fts WHERE bm25_score > 0) - (SELECT MIN(bm25_score) FROM fts WHERE bm25_score > 0) = 0 
-                        THEN 0
-                        ELSE (COALESCE(fts.bm25_score, 0) - (SELECT MIN(bm25_score) FROM fts WHERE bm25_score > 0)) / 
-                             NULLIF((SELECT MAX(bm25_score) FROM fts WHERE bm25_score > 0) - (SELECT MIN(bm25_score) FROM fts WHERE bm25_score > 0), 0)
-                    END as norm_bm25_score,
+                    -- Min-max normalization for BM25 scores (0 when the range is empty)
+                    COALESCE(
+                        (COALESCE(fts.bm25_score, 0) - bm25_stats.min_score) / 
+                        NULLIF(bm25_stats.max_score - bm25_stats.min_score, 0),
+                        0
+                    ) as norm_bm25_score,
                     -- Cosine similarity is already normalized [0,1], but ensure it's positive
                     GREATEST(COALESCE(semantic.cosine_score, 0), 0) as norm_cosine_score
                 FROM fts
                 FULL OUTER JOIN semantic ON fts.id = semantic.id
+                CROSS JOIN bm25_stats
             )
             SELECT 
                 id,
@@ -513,7 +654,9 @@ def test_search_functionality(
             WHERE (raw_bm25_score > 0 OR raw_cosine_score > 0)
             ORDER BY hybrid_score DESC
             LIMIT 5
-        """).fetchall()
+        """,
+            [test_query, query_embedding],
+        ).fetchall()
 
         print(f"    📊 Hybrid search found {len(hybrid_results)} results")
         for result in hybrid_results:
@@ -548,6 +691,15 @@ Examples:
     
     # Skip HNSW index if not supported
     python prepare_works_search.py --skip-hnsw
+    
+    # Run the model in half precision (faster on MPS; embeddings are stored as float32)
+    python prepare_works_search.py --fp16
+    
+    # Give the FTS and HNSW builds more memory and spill to a fast disk
+    python prepare_works_search.py --memory-limit 32GB --temp-dir /fast/ssd/tmp
+    
+    # Trade HNSW recall for build and query speed
+    python prepare_works_search.py --hnsw-m 16 --hnsw-ef-construction 128 --hnsw-ef-search 32
         """,
     )
 
@@ -583,6 +735,65 @@ Examples:
         help="Skip creating HNSW index (useful if not supported)",
     )
 
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Count works exactly instead of using DuckDB's row estimate",
+    )
+
+    parser.add_argument(
+        "--hnsw-m",
+        type=int,
+        default=HNSW_M,
+        help=f"HNSW neighbours per node (default: {HNSW_M})",
+    )
+
+    parser.add_argument(
+        "--hnsw-ef-construction",
+        type=int,
+        default=HNSW_EF_CONSTRUCTION,
+        help=f"HNSW candidate list size while building (default: {HNSW_EF_CONSTRUCTION})",
+    )
+
+    parser.add_argument(
+        "--hnsw-ef-search",
+        type=int,
+        default=HNSW_EF_SEARCH,
+        help=f"HNSW candidate list size while searching (default: {HNSW_EF_SEARCH})",
+    )
+
+    parser.add_argument(
+        "--memory-limit",
+        type=str,
+        default="12GB",
+        help="DuckDB memory limit (default: 12GB)",
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=os.cpu_count(),
+        help="DuckDB worker threads (default: number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--temp-dir",
+        type=str,
+        help="Directory DuckDB spills to when over the memory limit (default: a new temporary directory)",
+    )
+
+    parser.add_argument(
+        "--shard-dir",
+        type=str,
+        help="Directory for staged Parquet embedding shards (default: <db name>_work_embeddings next to the database)",
+    )
+
+    parser.add_argument(
+        "--fp16",
+        action="store_true",
+        help="Run the embedding model in half precision",
+    )
+
     parser.add_argument(
         "--model",
         type=str,
@@ -606,6 +817,11 @@ Examples:
         print("💡 Run setup_database.py and migrate_works.py first")
         sys.exit(1)
 
+    if args.shard_dir:
+        shard_dir = Path(args.shard_dir).resolve()
+    else:
+        shard_dir = db_path.with_name(f"{db_path.stem}_work_embeddings")
+
     print("🚀 DuckDB Works Search Preparation")
     print("=" * 40)
     print(f"📁 Database file: {db_path}")
@@ -614,11 +830,26 @@ Examples:
     print(f"🔄 Force rebuild: {args.force}")
     print(f"🔗 Skip HNSW: {args.skip_hnsw}")
     print(f"🧠 Model: {args.model}")
+    print(f"⚡ FP16: {args.fp16}")
+    print(f"🗃️  Shard directory: {shard_dir}")
+    print(f"💾 Memory limit: {args.memory_limit}")
+    print(f"🧵 Threads: {args.threads}")
 
     # Connect to database
     try:
         conn = duckdb.connect(str(db_path))
         print("✅ Connected to database")
+
+        # The FTS and HNSW builds are parallel and memory hungry: use every
+        # thread and spill to disk instead of running out of memory
+        temp_dir = args.temp_dir or tempfile.mkdtemp(prefix="duckdb_temp_")
+        print(f"🗂️  Using temporary directory: {temp_dir}")
+
+        conn.execute(f"SET memory_limit='{args.memory_limit}';")
+        conn.execute(f"SET threads={args.threads};")
+        conn.execute("SET temp_directory = ?;", [temp_dir])
+
+        print("⚙️  Configured DuckDB memory and thread settings")
     except Exception as e:
         print(f"❌ Failed to connect to database: {e}")
         sys.exit(1)
@@ -628,41 +859,48 @@ Examples:
         initialize_extensions(conn)
 
         # Check works table
-        table_info = check_works_table(conn)
+        table_info = check_works_table(conn, verify=args.verify)
         if not table_info["exists"]:
             print("❌ Works table not found. Run migration first.")
             sys.exit(1)
 
+        # One model instance is shared by embedding generation and search tests
+        model = load_model(args.model, half_precision=args.fp16)
+
         if args.test_only:
-            test_search_functionality(conn, model_name=args.model)
+            test_search_functionality(conn, model, ef_search=args.hnsw_ef_search)
         else:
-            # Get model dimensions for table creation
-            temp_model = SentenceTransformer(args.model, device="mps")
-            model_dim = temp_model.get_sentence_embedding_dimension()
-            print(f"📏 Using model with {model_dim} dimensions")
-
             # Create embeddings table
             create_embeddings_table(
-                conn, force_rebuild=args.force, embedding_dim=model_dim
+                conn,
+                force_rebuild=args.force,
+                embedding_dim=model.get_sentence_embedding_dimension(),
             )
 
+            # The HNSW index is rebuilt once embeddings are written; dropping it
+            # first avoids maintaining it on every insert
+            drop_hnsw_index(conn)
+
             # Create FTS index
             create_fts_index(conn, force_rebuild=args.force)
 
             # Generate embeddings
             generate_embeddings(
                 conn,
+                model,
+                shard_dir,
                 batch_size=args.batch_size,
                 force_regenerate=args.force,
-                model_name=args.model,
             )
 
             # Create HNSW index (if not skipped)
             if not args.skip_hnsw:
-                create_hnsw_index(conn)
+                create_hnsw_index(
+                    conn, m=args.hnsw_m, ef_construction=args.hnsw_ef_construction
+                )
 
             # Test functionality
-            test_search_functionality(conn, model_name=args.model)
+            test_search_functionality(conn, model, ef_search=args.hnsw_ef_search)
 
             print("\n🎉 Works search preparation completed!")
             print("💡 You can now use both full-text and semantic search on works")
@@ -11,6 +11,7 @@ Usage:
 
 import argparse
 import sys
+import time
 from pathlib import Path
 import duckdb
 
@@ -33,6 +34,15 @@ def read_sql_file(sql_path: Path) -> str:
         sys.exit(1)
 
 
+def describe_statement(query: str) -> str:
+    """Return the first line of SQL in a statement, skipping comments"""
+    for line in query.splitlines():
+        line = line.strip()
+        if line and not line.startswith("--"):
+            return line if len(line) <= 60 else f"{line[:57]}..."
+    return "(empty statement)"
+
+
 def setup_database(db_path: Path, sql_content: str) -> None:
     """Create the database and execute the SQL schema"""
     print(f"Setting up DuckDB database at: {db_path}")
@@ -45,10 +55,24 @@ def setup_database(db_path: Path, sql_content: str) -> None:
         conn = duckdb.connect(str(db_path))
 
         print("Connected to database successfully")
-        print("Executing schema creation...")
 
-        # Execute the SQL schema
-        conn.execute(sql_content)
+        # Run the schema one statement at a time so a failure names the
+        # statement that caused it; a single transaction keeps it all-or-nothing
+        statements = duckdb.extract_statements(sql_content)
+        print(f"Executing schema creation ({len(statements)} statements)...")
+
+        conn.execute("BEGIN TRANSACTION")
+        for statement in statements:
+            description = describe_statement(statement.query)
+            start_time = time.perf_counter()
+            try:
+                conn.execute(statement)
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                print(f"Error in statement: {description}: {e}")
+                raise
+            print(f"  {description} ({time.perf_counter() - start_time:.2f}s)")
+        conn.execute("COMMIT")
 
         print("Schema created successfully!")
 
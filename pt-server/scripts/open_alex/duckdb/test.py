@@ -1,5 +1,7 @@
 import pathlib
-import polars as pl
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import duckdb
 
 dest = pathlib.Path("/Volumes/T7/openalex-parquet/authors/test")
@@ -16,6 +18,9 @@ def configure_duckdb(conn):
     conn.execute(f"SET temp_directory='{tmp_dir}';")
     conn.execute("SET memory_limit='128GB';")
     conn.execute("SET max_temp_directory_size='100GB';")
+    # Several pages and files are read at once; only prefetch the row groups
+    # each scan needs rather than every file up front
+    conn.execute("SET prefetch_all_parquet_files=false;")
 
 
 def get_page_path(num: int) -> pathlib.Path:
@@ -24,25 +29,57 @@ def get_page_path(num: int) -> pathlib.Path:
     return pathlib.Path(f"/Volumes/T7/openalex-parquet/authors/part_{num_str}.parquet")
 
 
+# Pages converted at once by save_topics_parquet
+TOPIC_PAGE_WORKERS = 4
+
+# Tables copied at once by copy_duckdb
+COPY_TABLE_WORKERS = 4
+
+
+def save_topics_page(conn, page_num: int) -> int:
+    """Write the author topic rows of one parquet page to its own file."""
+    cursor = conn.cursor()
+    try:
+        # DuckDB decodes the page's row groups in parallel and unnests the
+        # topic_share list in one pass; ROW_GROUP_SIZE matches its own, so
+        # import_to_duckdb's scan splits evenly
+        cursor.execute(f"""
+            COPY (
+                SELECT 
+                    id AS author_id,
+                    topic.id AS topic_id,
+                    topic.value AS value
+                FROM read_parquet('{get_page_path(page_num)}'), 
+                    UNNEST(topic_share) AS t(topic)
+                WHERE summary_stats.h_index >= 4
+                    AND id IS NOT NULL
+                    AND topic.id IS NOT NULL
+                    AND topic.value IS NOT NULL
+            ) TO '{dest / f"author_topics_{page_num}.parquet"}' 
+            (FORMAT PARQUET, COMPRESSION LZ4, ROW_GROUP_SIZE 122880)
+        """)
+    finally:
+        cursor.close()
+    return page_num
+
+
 def save_topics_parquet():
-    for page_num in range(96, 106):  # 97 to 105 inclusive
-        df = pl.scan_parquet(get_page_path(page_num))
-        q = (
-            df.select(
-                pl.col("id"),
-                pl.col("summary_stats").struct.field("h_index").alias("h_index"),
-                pl.col("topic_share"),
-            )
-            .filter(pl.col("h_index") >= 4)
-            .explode("topic_share")
-            .select(
-                pl.col("id").alias("author_id"),
-                pl.col("topic_share").struct.field("id").alias("topic_id"),
-                pl.col("topic_share").struct.field("value").alias("value"),
-            )
-            .drop_nulls()
-        )
-        q.sink_parquet(dest / f"author_topics_{page_num}.parquet", compression="lz4")
+    """Convert pages 96 to 105, several pages at a time."""
+    pages = range(96, 106)
+
+    conn = duckdb.connect()
+    configure_duckdb(conn)
+
+    # Each page gets its own cursor; the cursors share one DuckDB thread pool,
+    # so running pages together adds I/O depth without oversubscribing cores
+    try:
+        with ThreadPoolExecutor(max_workers=TOPIC_PAGE_WORKERS) as executor:
+            for page_num in executor.map(
+                lambda page_num: save_topics_page(conn, page_num), pages
+            ):
+                print(f"Saved author_topics_{page_num}.parquet")
+    finally:
+        conn.close()
 
 
 def import_to_duckdb():
@@ -71,26 +108,43 @@ def import_to_duckdb():
         "author_topics_98.parquet",
     ]
 
+    files = []
+    for parquet_file in parquet_files:
+        if parquet_file.name in skip:
+            print(f"Skipping {parquet_file.name} to avoid duplicates...")
+            continue
+        files.append(str(parquet_file))
+
+    if not files:
+        print("No parquet files left to import")
+        conn.close()
+        return
+
     try:
-        for parquet_file in parquet_files:
-            if parquet_file.name in skip:
-                print(f"Skipping {parquet_file.name} to avoid duplicates...")
-                continue
-            print(f"Importing {parquet_file.name}...")
-
-            # Use DuckDB's direct parquet reading capability with INSERT OR IGNORE
-            query = f"""
-            INSERT OR IGNORE INTO author_topics 
-            SELECT author_id, topic_id, value 
-            FROM read_parquet('{parquet_file}')
+        print(f"Importing {len(files)} parquet files...")
+
+        # One statement over all files lets DuckDB scan them in parallel and
+        # commit once, instead of a statement and commit per file. Rows already
+        # in the table are dropped with a hash anti-join rather than per-row
+        # INSERT OR IGNORE conflict checks.
+        conn.execute("BEGIN TRANSACTION;")
+        conn.execute(
             """
+            INSERT INTO author_topics 
+            SELECT DISTINCT ON (p.author_id, p.topic_id) 
+                p.author_id, p.topic_id, p.value 
+            FROM read_parquet(?, union_by_name = true) p
+            ANTI JOIN author_topics t 
+                ON t.author_id = p.author_id AND t.topic_id = p.topic_id
+            """,
+            [files],
+        )
+        conn.execute("COMMIT;")
 
-            conn.execute(query)
-            print(f"Successfully imported {parquet_file.name}")
-
-        print(f"Imported {len(parquet_files)} parquet files into author_topics table")
+        print(f"Imported {len(files)} parquet files into author_topics table")
 
     except Exception as e:
+        conn.execute("ROLLBACK;")
         print(f"Error importing parquet files: {e}")
     finally:
         conn.close()
@@ -105,7 +159,9 @@ def checkpoint_database():
 
     try:
         print("Running checkpoint on source database...")
-        conn.execute("CHECKPOINT;")
+        # FORCE also aborts running transactions instead of skipping the
+        # checkpoint, so the copy always starts from a fully written file
+        conn.execute("FORCE CHECKPOINT;")
         print("Checkpoint completed successfully")
 
     except Exception as e:
@@ -138,12 +194,45 @@ def copy_duckdb():
         conn.execute(f"ATTACH '{source_path}' AS source_db;")
         conn.execute(f"ATTACH '{dest_path}' AS dest_db;")
 
-        print("Copying database...")
-
-        # Copy from source to destination
-        conn.execute("COPY FROM DATABASE source_db TO dest_db;")
+        print("Copying schema...")
+
+        # Copy the schema first, then fill the tables concurrently, each on
+        # its own cursor; appends to different tables don't conflict
+        conn.execute("COPY FROM DATABASE source_db TO dest_db (SCHEMA);")
+
+        tables = conn.execute("""
+            SELECT schema_name, table_name
+            FROM duckdb_tables()
+            WHERE database_name = 'source_db'
+            ORDER BY estimated_size DESC
+        """).fetchall()
+
+        def copy_table(schema_name: str, table_name: str) -> None:
+            cursor = conn.cursor()
+            try:
+                start_time = time.perf_counter()
+                cursor.execute(f"""
+                    INSERT INTO dest_db."{schema_name}"."{table_name}"
+                    SELECT * FROM source_db."{schema_name}"."{table_name}"
+                """)
+                print(f"Copied {table_name} in {time.perf_counter() - start_time:.2f}s")
+            finally:
+                cursor.close()
+
+        print(f"Copying {len(tables)} tables...")
+
+        with ThreadPoolExecutor(max_workers=COPY_TABLE_WORKERS) as executor:
+            futures = [executor.submit(copy_table, *table) for table in tables]
+            for future in futures:
+                future.result()
+
+        # Detach so the destination is checkpointed before its size is read
+        conn.execute("DETACH dest_db;")
 
         print(f"Successfully copied {source_path.name} to {dest_path.name}")
+        print(
+            f"Size: {source_path.stat().st_size:,} bytes -> {dest_path.stat().st_size:,} bytes"
+        )
 
     except Exception as e:
         print(f"Error copying database: {e}")
@@ -1,11 +1,6 @@
 from pathlib import Path
-import polars as pl
-from ..schemas import author_schema
-import glob
-import re
-
-# Set streaming mode for large datasets
-pl.Config.set_streaming_chunk_size(10_000)
+import duckdb
+import os
 
 parquet_path = Path("/Volumes/T7/openalex-parquet")
 authors_path = parquet_path / "authors"
@@ -14,88 +9,66 @@ output_path = parquet_path / "pre-dernom" / "authors"
 # Create output directory
 output_path.mkdir(parents=True, exist_ok=True)
 
+# DuckDB runs the filter → explode → partitioned write as one vectorized plan,
+# spilling to disk instead of holding every partition writer in memory
+conn = duckdb.connect()
+conn.execute("SET preserve_insertion_order=false;")
+
 print("📁 Scanning individual part files...")
 
-# Get all part files and extract part numbers
-part_files = glob.glob(str(authors_path / "part_*.parquet"))
-part_files.sort()
+# Get all part files and their part numbers from one directory scan
+part_files = sorted(
+    (entry.path, entry.name[len("part_") : -len(".parquet")])
+    for entry in os.scandir(authors_path)
+    if entry.name.startswith("part_")
+    and entry.name.endswith(".parquet")
+    and entry.name[len("part_") : -len(".parquet")].isdigit()
+)
 
 print(f"Found {len(part_files)} part files")
 
-for part_file in part_files:
-    # Extract part number from filename
-    part_match = re.search(r"part_(\d+)\.parquet", part_file)
-    if not part_match:
-        continue
-
-    part_number = part_match.group(1)
-    print(f"Processing part_{part_number}...")
-
-    # Read the individual part file
-    authors_df = pl.scan_parquet(part_file, schema=author_schema, low_memory=True)
-
-    # Transform and add part column
-    authors_transformed_raw = authors_df.filter(
-        (pl.col("cited_by_count") > 0)
-        & (pl.col("summary_stats").struct.field("h_index") >= 4)
-        & (pl.col("topic_share").list.len() > 0)
-    ).select(
-        [
-            "id",
-            "orcid",
-            "display_name",
-            "display_name_alternatives",
-            "works_count",
-            "cited_by_count",
-            "summary_stats",
-            "ids",
-            pl.col("last_known_institutions")
-            .list.eval(
-                pl.struct(
-                    [
-                        pl.element().struct.field("id"),
-                        pl.element().struct.field("display_name"),
-                        pl.element().struct.field("country_code"),
-                    ]
-                )
-            )
-            .alias("latest_institutions"),
-            pl.col("topic_share")
-            .list.eval(
-                pl.struct(
-                    [
-                        pl.element().struct.field("id"),
-                        pl.element().struct.field("value"),
-                    ]
-                )
-            )
-            .alias("topics"),
-            pl.lit(part_number).alias("part"),
-        ]
-    )
-
-    # Explode topics and transform structure
-    authors_exploded = (
-        authors_transformed_raw.explode("topics")
-        .with_columns(
-            [
-                pl.col("id").alias("author_id"),
-                pl.col("topics").struct.field("id").alias("topic_id"),
-                pl.col("topics").struct.field("value").alias("topic_share_value"),
-            ]
-        )
-        .drop(["id", "topics"])
-    )
-
+for part_file, part_number in part_files:
     print(f"💾 Writing part_{part_number} with hive partitioning...")
 
-    # Write with hive partitioning on topic_id
-    authors_exploded.sink_parquet(
-        pl.PartitionByKey(
-            base_path=str(output_path), by=["topic_id", "part"], include_key=True
-        ),
-        compression="lz4",
-        mkdir=True,
+    # Explode topics and write with hive partitioning on topic_id; each part
+    # gets its own file name in the topic directories. topic_id is only kept
+    # in the directory name and restored when the partitions are merged.
+    conn.execute(
+        f"""
+        COPY (
+            SELECT
+                orcid,
+                display_name,
+                display_name_alternatives,
+                works_count,
+                cited_by_count,
+                summary_stats,
+                ids,
+                list_transform(
+                    last_known_institutions,
+                    i -> struct_pack(
+                        id := i.id,
+                        display_name := i.display_name,
+                        country_code := i.country_code
+                    )
+                ) AS latest_institutions,
+                id AS author_id,
+                topic.id AS topic_id,
+                topic.value AS topic_share_value
+            FROM read_parquet(?), UNNEST(topic_share) AS t(topic)
+            WHERE cited_by_count > 0
+                AND summary_stats.h_index >= 4
+                AND len(topic_share) > 0
+        ) TO '{output_path}' (
+            FORMAT PARQUET,
+            PARTITION_BY (topic_id),
+            FILENAME_PATTERN 'part_{part_number}_{{i}}',
+            COMPRESSION LZ4,
+            ROW_GROUP_SIZE 122880,
+            OVERWRITE_OR_IGNORE
+        )
+        """,
+        [part_file],
     )
 
 print("✅ Successfully processed all parts and saved with hive partitioning!")
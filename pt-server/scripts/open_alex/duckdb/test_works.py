@@ -1,13 +1,8 @@
 from pathlib import Path
-import polars as pl
-from ..schemas import work_schema
-import glob
-import re
+import duckdb
+import os
 import time
 
-# Set streaming mode for large datasets
-pl.Config.set_streaming_chunk_size(10_000)
-
 parquet_path = Path("/Volumes/T7/openalex-parquet")
 works_path = parquet_path / "works"
 output_path = parquet_path / "pre-dernom" / "works"
@@ -15,193 +10,155 @@ output_path = parquet_path / "pre-dernom" / "works"
 # Create output directory
 output_path.mkdir(parents=True, exist_ok=True)
 
+# DuckDB aggregates the works into nested lists with a vectorized hash
+# aggregate, spilling to disk instead of running out of memory
+conn = duckdb.connect()
+conn.execute("SET preserve_insertion_order=false;")
+
 print("📁 Scanning individual part files...")
 
-# Get all part files and extract part numbers
-part_files = glob.glob(str(works_path / "part_*.parquet"))
-part_files.sort()
+# Get all part files and their part numbers from one directory scan
+part_files = sorted(
+    (entry.path, entry.name[len("part_") : -len(".parquet")])
+    for entry in os.scandir(works_path)
+    if entry.name.startswith("part_")
+    and entry.name.endswith(".parquet")
+    and entry.name[len("part_") : -len(".parquet")].isdigit()
+)
 
 print(f"Found {len(part_files)} part files")
 
-# Initialize timing variables
-processing_times = []
-start_time_total = time.time()
 
-for i, part_file in enumerate(part_files, 1):
-    # Extract part number from filename
-    part_match = re.search(r"part_(\d+)\.parquet", part_file)
-    if not part_match:
-        continue
+def format_time(seconds):
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    secs = int(seconds % 60)
+    if hours > 0:
+        return f"{hours}h {minutes}m {secs}s"
+    elif minutes > 0:
+        return f"{minutes}m {secs}s"
+    else:
+        return f"{secs}s"
+
+
+# Initialize timing variables; a running total gives the average without
+# keeping every duration
+processed_parts = 0
+processing_ns_total = 0
+start_ns_total = time.perf_counter_ns()
 
-    part_number = part_match.group(1)
+for i, (part_file, part_number) in enumerate(part_files, 1):
     if int(part_number) < 118:
         print(f"Skipping part_{part_number}...")
         continue
-    part_start_time = time.time()
+    part_start_ns = time.perf_counter_ns()
     print(f"Processing part_{part_number} ({i}/{len(part_files)})...")
 
-    # Read the individual part file
-    works_df = pl.scan_parquet(part_file, schema=work_schema, low_memory=True)
+    print(f"🔗 Grouping works by author and topic for part_{part_number}...")
 
-    # Transform and add part column
-    works_transformed = (
-        works_df.filter(
-            (~pl.col("is_paratext"))
-            & (pl.col("authorships").is_not_null())
-            & (pl.col("authorships").list.len() > 0)
-            & (pl.col("primary_topic").struct.field("id").is_not_null())
-        )
-        .select(
-            [
-                "id",
-                "doi",
-                "title",
-                "display_name",
-                "publication_date",
-                "language",
-                "type",
-                pl.col("open_access").struct.field("oa_url").alias("oa_url"),
-                "ids",
-                pl.col("primary_topic").struct.field("id").alias("topic_id"),
-                pl.col("citation_normalized_percentile")
-                .struct.field("value")
-                .alias("citation_normalized_percentile_value"),
-                "cited_by_count",
-                "fwci",
-                pl.col("authorships")
-                .list.eval(
-                    pl.struct(
-                        [
-                            pl.element()
-                            .struct.field("author_position")
-                            .alias("author_position"),
-                            pl.struct(
-                                [
-                                    pl.element()
-                                    .struct.field("author")
-                                    .struct.field("id")
-                                    .alias("id"),
-                                    pl.element()
-                                    .struct.field("author")
-                                    .struct.field("display_name")
-                                    .alias("display_name"),
-                                    pl.element()
-                                    .struct.field("author")
-                                    .struct.field("orcid")
-                                    .alias("orcid"),
-                                ]
-                            ).alias("author"),
-                            pl.element()
-                            .struct.field("institutions")
-                            .list.eval(
-                                pl.struct(
-                                    [
-                                        pl.element().struct.field("id"),
-                                        pl.element().struct.field("display_name"),
-                                    ]
+    # One DuckDB plan per part: filter, slim the authorships, explode on
+    # author id, hash-aggregate each (author, topic) group into a list of work
+    # structs and write it with hive partitioning on topic_id. Each part gets
+    # its own file name in the topic directories; topic_id is only kept in the
+    # directory name and restored when the partitions are merged.
+    conn.execute(
+        f"""
+        COPY (
+            SELECT
+                author_id,
+                topic_id,
+                list(
+                    struct_pack(
+                        id,
+                        doi,
+                        title,
+                        display_name,
+                        publication_date,
+                        language,
+                        type,
+                        oa_url,
+                        ids,
+                        citation_normalized_percentile_value,
+                        cited_by_count,
+                        fwci,
+                        authorships,
+                        created_date,
+                        updated_date
+                    )
+                ) AS works,
+                sum(cited_by_count)::BIGINT AS total_citations_in_topic,
+                avg(fwci) AS average_fwci_in_topic,
+                count(*) AS works_count_in_topic,
+                max(publication_date) AS latest_publication_date_in_topic
+            FROM (
+                SELECT
+                    id,
+                    doi,
+                    title,
+                    display_name,
+                    publication_date,
+                    language,
+                    type,
+                    open_access.oa_url AS oa_url,
+                    ids,
+                    primary_topic.id AS topic_id,
+                    citation_normalized_percentile.value 
+                        AS citation_normalized_percentile_value,
+                    cited_by_count,
+                    fwci,
+                    list_transform(
+                        authorships,
+                        a -> struct_pack(
+                            author_position := a.author_position,
+                            author := a.author,
+                            institutions := list_transform(
+                                a.institutions,
+                                i -> struct_pack(
+                                    id := i.id,
+                                    display_name := i.display_name
                                 )
                             )
-                            .alias("institutions"),
-                        ]
-                    )
-                )
-                .alias("authorships"),
-                pl.col("authorships")
-                .list.eval(pl.element().struct.field("author").struct.field("id"))
-                .alias("author_id"),
-                "created_date",
-                "updated_date",
-                pl.lit(part_number).alias("part"),
-            ]
+                        )
+                    ) AS authorships,
+                    created_date,
+                    updated_date,
+                    unnest(list_transform(authorships, a -> a.author.id)) AS author_id
+                FROM read_parquet(?)
+                WHERE NOT is_paratext
+                    AND authorships IS NOT NULL
+                    AND len(authorships) > 0
+                    AND primary_topic.id IS NOT NULL
+            )
+            GROUP BY author_id, topic_id
+        ) TO '{output_path}' (
+            FORMAT PARQUET,
+            PARTITION_BY (topic_id),
+            FILENAME_PATTERN 'part_{part_number}_{{i}}',
+            COMPRESSION LZ4,
+            ROW_GROUP_SIZE 122880,
+            OVERWRITE_OR_IGNORE
         )
-        .explode("author_id")
-    )
-
-    print(f"🔗 Grouping works by author and topic for part_{part_number}...")
-
-    # Group works by author_id and topic_id with aggregations
-    works_grouped = works_transformed.group_by(["author_id", "topic_id"]).agg(
-        [
-            pl.struct(
-                [
-                    "id",
-                    "doi",
-                    "title",
-                    "display_name",
-                    "publication_date",
-                    "language",
-                    "type",
-                    "oa_url",
-                    "ids",
-                    "citation_normalized_percentile_value",
-                    "cited_by_count",
-                    "fwci",
-                    "authorships",
-                    "created_date",
-                    "updated_date",
-                ]
-            ).alias("works"),
-            pl.col("cited_by_count").sum().alias("total_citations_in_topic"),
-            pl.col("fwci").mean().alias("average_fwci_in_topic"),
-            pl.len().alias("works_count_in_topic"),
-            pl.col("publication_date").max().alias("latest_publication_date_in_topic"),
-            pl.first("part").alias("part"),  # Keep the part number
-        ]
-    )
-
-    print(f"💾 Writing part_{part_number} with hive partitioning...")
-
-    # Write with hive partitioning on topic_id and part
-    works_grouped.sink_parquet(
-        pl.PartitionByKey(
-            base_path=str(output_path), by=["topic_id", "part"], include_key=True
-        ),
-        compression="lz4",
-        mkdir=True,
-        # use_pyarrow=True,
+        """,
+        [part_file],
     )
 
     # Calculate timing and estimates
-    part_end_time = time.time()
-    part_duration = part_end_time - part_start_time
-    processing_times.append(part_duration)
+    part_duration_ns = time.perf_counter_ns() - part_start_ns
+    processed_parts += 1
+    processing_ns_total += part_duration_ns
 
     # Calculate average time and estimate completion
-    avg_time = sum(processing_times) / len(processing_times)
+    part_duration = part_duration_ns / 1e9
+    avg_time = processing_ns_total / processed_parts / 1e9
     remaining_parts = len(part_files) - i
     estimated_remaining_time = remaining_parts * avg_time
 
-    # Format time estimates
-    def format_time(seconds):
-        hours = int(seconds // 3600)
-        minutes = int((seconds % 3600) // 60)
-        secs = int(seconds % 60)
-        if hours > 0:
-            return f"{hours}h {minutes}m {secs}s"
-        elif minutes > 0:
-            return f"{minutes}m {secs}s"
-        else:
-            return f"{secs}s"
-
     print(
         f"     Completed in {format_time(part_duration)} | Avg: {format_time(avg_time)} | ETA: {format_time(estimated_remaining_time)}"
     )
 
 # Final timing summary
-total_time = time.time() - start_time_total
-
-
-def format_time(seconds):
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
-    if hours > 0:
-        return f"{hours}h {minutes}m {secs}s"
-    elif minutes > 0:
-        return f"{minutes}m {secs}s"
-    else:
-        return f"{secs}s"
-
+total_time = (time.perf_counter_ns() - start_ns_total) / 1e9
 
 print(f"✅ Successfully processed all parts and saved with hive partitioning!")
 print(f"📊 Total processing time: {format_time(total_time)}")
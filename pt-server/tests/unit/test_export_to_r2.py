@@ -0,0 +1,40 @@
+"""
+Tests for the OpenAlex export and inspection script.
+"""
+
+import polars as pl
+import pytest
+from scripts.open_alex import export_to_r2
+
+
+class TestCountEntityRows:
+    """Test counting entity rows from parquet footers."""
+
+    @pytest.fixture
+    def entity_root(self, tmp_path, monkeypatch):
+        """Point the export script at a temporary parquet root."""
+        monkeypatch.setattr(export_to_r2, "parquet_destination_path", tmp_path)
+        return tmp_path
+
+    def test_matches_scan_count(self, entity_root):
+        """Test that the footer count matches scanning the files."""
+        entity_path = entity_root / "authors"
+        entity_path.mkdir()
+        for part, n_rows in enumerate([3, 0, 250]):
+            pl.DataFrame({"id": [f"A{part}-{i}" for i in range(n_rows)]}).write_parquet(
+                entity_path / f"part_{part:04d}.parquet", row_group_size=100
+            )
+
+        df = pl.scan_parquet(entity_path / "*.parquet")
+
+        assert export_to_r2.count_entity_rows(df, "authors") == 253
+        assert (
+            export_to_r2.count_entity_rows(df, "authors")
+            == df.select(pl.len()).collect().item()
+        )
+
+    def test_falls_back_to_scan_without_entity_folder(self, entity_root):
+        """Test that frames without an entity folder are counted by scanning."""
+        df = pl.LazyFrame({"id": ["a", "b"]})
+
+        assert export_to_r2.count_entity_rows(df, "DataFrame") == 2
@@ -0,0 +1,44 @@
+"""
+Tests for the OpenAlex DuckDB setup script.
+"""
+
+import duckdb
+from scripts.open_alex.duckdb.setup_database import describe_statement
+
+
+class TestDescribeStatement:
+    """Test the statement descriptions printed by setup_database."""
+
+    def test_multi_statement_sql(self):
+        """Test describing each statement of a multi-statement SQL string."""
+        sql = """
+            -- Authors
+            CREATE TABLE authors (id VARCHAR PRIMARY KEY);
+
+            -- Works and their index
+            CREATE TABLE works (id VARCHAR PRIMARY KEY, title VARCHAR);
+            CREATE INDEX works_title_idx ON works (title);
+        """
+
+        # The last statement keeps its terminating semicolon
+        descriptions = [
+            describe_statement(statement.query).rstrip(";")
+            for statement in duckdb.extract_statements(sql)
+        ]
+
+        assert descriptions == [
+            "CREATE TABLE authors (id VARCHAR PRIMARY KEY)",
+            "CREATE TABLE works (id VARCHAR PRIMARY KEY, title VARCHAR)",
+            "CREATE INDEX works_title_idx ON works (title)",
+        ]
+
+    def test_long_line_is_truncated(self):
+        """Test that long first lines are cut to 60 characters."""
+        description = describe_statement("SELECT " + ", ".join(["column_name"] * 20))
+
+        assert len(description) == 60
+        assert description.endswith("...")
+
+    def test_comment_only_statement(self):
+        """Test that a statement with no SQL lines is reported as empty."""
+        assert describe_statement("-- nothing here\n") == "(empty statement)"